@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import random
+import socket
+import time
+
+from threading import Lock
+
+#https://github.com/Uberi/speech_recognition
+import speech_recognition
+
+
+class SegmentAudio(speech_recognition.AudioData):
+    """AudioData over a segment's PCM buffer that encodes each format once.
+
+    The buffer from VAD (bytes or a memoryview) is used as is. Raw, WAV and
+    FLAC encodings are memoized per conversion, so the FLAC a recognizer
+    uploads (again on every retry) and the WAV clip that is saved are each
+    produced at most once, and the FLAC is encoded from that same WAV. A
+    convert_rate or convert_width equal to the audio's own counts as no
+    conversion.
+    """
+
+    def __init__(self, frame_data, sample_rate, sample_width):
+        super().__init__(frame_data, sample_rate, sample_width)
+        self.encoded = {}
+
+    def encode(self, fmt, convert_rate, convert_width):
+        if convert_rate == self.sample_rate:
+            convert_rate = None
+        if convert_width == self.sample_width:
+            convert_width = None
+        key = (fmt, convert_rate, convert_width)
+        if key not in self.encoded:
+            encoder = getattr(speech_recognition.AudioData, 'get_%s_data' % fmt)
+            self.encoded[key] = encoder(self, convert_rate, convert_width)
+        return self.encoded[key]
+
+    def get_raw_data(self, convert_rate=None, convert_width=None):
+        return self.encode('raw', convert_rate, convert_width)
+
+    def get_wav_data(self, convert_rate=None, convert_width=None):
+        return self.encode('wav', convert_rate, convert_width)
+
+    def get_flac_data(self, convert_rate=None, convert_width=None):
+        return self.encode('flac', convert_rate, convert_width)
+
+
+class Backend(object):
+    """Base class for speech recognizer backends.
+
+    recognize() takes a speech_recognition.AudioData and a language code,
+    and returns the transcript. It raises speech_recognition.UnknownValueError
+    when the audio is unintelligible, and speech_recognition.RequestError
+    (or socket.timeout) when the recognizer itself fails.
+
+    timeout is the number of seconds to wait for the recognizer to respond,
+    for backends that talk to a service.
+    """
+    name = None
+
+    def recognize(self, audio_data, language):
+        raise NotImplementedError
+
+
+class GoogleBackend(Backend):
+    """Google Web Speech API (network)."""
+    name = 'google'
+
+    def __init__(self, timeout=None):
+        self.recognizer = speech_recognition.Recognizer()
+        self.recognizer.operation_timeout = timeout
+
+    def recognize(self, audio_data, language):
+        return self.recognizer.recognize_google(audio_data, language=language)
+
+
+class SphinxBackend(Backend):
+    """CMU PocketSphinx, runs locally without network access.
+
+    Needs the pocketsphinx package and a model for the requested language.
+    """
+    name = 'sphinx'
+
+    def __init__(self, timeout=None):
+        self.recognizer = speech_recognition.Recognizer()
+
+    def recognize(self, audio_data, language):
+        return self.recognizer.recognize_sphinx(audio_data, language=language)
+
+
+class StubBackend(Backend):
+    """Deterministic recognizer for benchmarking.
+
+    Returns a transcript derived from the segment audio, optionally after
+    sleeping for latency seconds to stand in for a remote service. A
+    latency above timeout sleeps for timeout and then fails the request.
+    """
+    name = 'stub'
+
+    def __init__(self, timeout=None, latency=0.0):
+        self.timeout = timeout
+        self.latency = latency
+
+    def recognize(self, audio_data, language):
+        if self.timeout is not None and self.latency > self.timeout:
+            time.sleep(self.timeout)
+            raise socket.timeout("stub recognizer timed out")
+        if self.latency:
+            time.sleep(self.latency)
+        data = memoryview(audio_data.frame_data).cast('B')
+        if not data:
+            raise speech_recognition.UnknownValueError()
+        duration = len(data) / float(audio_data.sample_rate *
+                                     audio_data.sample_width)
+        return "%s %.3fs %s" % (language, duration,
+                                hashlib.sha1(data).hexdigest()[:8])
+
+
+class RateLimiter(object):
+    """Token bucket allowing rate requests per second on average.
+
+    Up to burst requests may be made back to back. Shared between threads.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Blocks until a request may be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryingBackend(Backend):
+    """Wraps a backend with rate limiting and retries.
+
+    Failed requests are retried up to retries times, sleeping for an
+    exponentially growing, jittered delay starting at backoff seconds.
+    Every attempt first takes a token from limiter, if one is given.
+    Unintelligible audio is not retried.
+    """
+
+    def __init__(self, backend, retries=3, backoff=1.0, limiter=None):
+        self.backend = backend
+        self.name = backend.name
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter
+
+    def recognize(self, audio_data, language):
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                return self.backend.recognize(audio_data, language)
+            except (speech_recognition.RequestError, socket.timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+                logging.warning("ASR request failed (%s), retrying in %.1fs" %
+                                (e, delay))
+                time.sleep(delay)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (GoogleBackend, SphinxBackend, StubBackend)
+}
+
+
+def create_backend(name, **kwargs):
+    """Instantiates the recognizer backend registered under name."""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown ASR backend: %s" % name)
+    return backend(**kwargs)
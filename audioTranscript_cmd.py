@@ -1,133 +1,725 @@
-import logging, os, sys
-import multiprocessing.dummy
+import asyncio, bisect, glob, json, logging, math, os, socket, subprocess, sys, time
 
-from datetime import timedelta
-from multiprocessing import Process
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from threading import Lock
 
 import moviepy.editor as mp
-import numpy as np
+from moviepy.config import get_setting
 
 #https://github.com/Uberi/speech_recognition
 import speech_recognition
-import srt
 
+import asrBackend
+import jobManifest
+import pipelineStats
+import segmentWriter
+import srtWriter
+import transcriptCache
+import wavSplit
 import wavTranscriber
 
 # Debug helpers
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
 
+class Job:
+    # State of one input being transcribed
+
+    def __init__(self, input_path, name, audio_path, input_is_video, output,
+                 manifest, stats, segment_writer, srt_path):
+        self.input_path = input_path
+        # Base name of the input's files in the output directory
+        self.name = name
+        # None when the audio is decoded straight into VAD
+        self.audio_path = audio_path
+        self.input_is_video = input_is_video
+        self.output = output
+        self.manifest = manifest
+        self.segment_writer = segment_writer
+        self.sample_rate = None
+        self.audio_duration = None
+        self.stats = stats
+        self.srt_writer = srtWriter.OrderedSrtWriter(srt_path)
+        self.video_intervals = []
+        self.segments_done = 0
+        # wavSplit.EnergyGate used for VAD, if any
+        self.gate = None
+
+
 class AudioVideoSplitter:
 
-    def __init__(self, aggressive, lang, output, threads):
+    def __init__(self, aggressive, lang, output, threads, reader='memory',
+                 engine='collector', vad_workers=1, stream_copy=False,
+                 backend='google', timeout=None, retries=3, rate=None,
+                 cache=None, cache_size=100, resume=False, decode='wav',
+                 max_segment=None, min_segment=None, segment_format='files',
+                 write_batch=16, gate_rms=None, gate_peak=None, frame_ms=10,
+                 padding_ms=300, start_percentage=0.85,
+                 stop_percentage=0.20, shard_s=600, overlap_s=300):
         # Initialize arguments
         self.aggressive = aggressive
+        self.reader = reader
+        self.engine = engine
+        self.vad_workers = vad_workers
+        # Only used with vad_workers > 1
+        self.shard_params = dict(shard_duration_s=shard_s,
+                                 overlap_duration_s=overlap_s)
+        self.stream_copy = stream_copy
+        self.decode = decode
+        self.max_segment = max_segment
+        self.min_segment = min_segment
+        self.gate_rms = gate_rms
+        self.gate_peak = gate_peak
+        # Passed to every segment generator
+        wavTranscriber.check_frame_duration(frame_ms)
+        self.vad_params = dict(frame_duration_ms=frame_ms,
+                               padding_duration_ms=padding_ms,
+                               start_percentage=start_percentage,
+                               stop_percentage=stop_percentage)
+        self.segment_format = segment_format
+        self.write_batch = write_batch
         self.lang = lang
         self.output = output
         os.makedirs(output, exist_ok=True)
-        self.input_is_video = False
 
-        self.asr = speech_recognition.Recognizer()
-        self.transcript_list = []
+        limiter = asrBackend.RateLimiter(rate) if rate else None
+        self.asr = asrBackend.RetryingBackend(
+            asrBackend.create_backend(backend, timeout=timeout),
+            retries=retries,
+            limiter=limiter)
+        self.cache = None
+        if cache is not None:
+            self.cache = transcriptCache.TranscriptCache(
+                cache, cache_size * 1024 * 1024)
+        self.resume = resume
         self.threads = threads
         self.mutex = Lock()
 
     def process_input(self, input_path):
-        self.input_path = input_path
+        asyncio.run(self.run_inputs([input_path], 1, batch=False))
+
+    def process_batch(self, input_paths, parallel_files):
+        # Transcribes many inputs, parallel_files at a time, with VAD and
+        # recognition of all of them sharing the same worker pools. Each
+        # input's segments go to a subdirectory of the output directory
+        # named by output_names, and an input that fails is logged and
+        # skipped.
+        asyncio.run(self.run_inputs(input_paths, parallel_files))
+
+    def prepare_input(self, input_path, output, name):
+        stats = pipelineStats.PipelineStats()
+        # An input whose stem is shared with another batch input keeps its
+        # converted wav and SRT in its output directory, where they cannot
+        # collide
+        local = name != Path(input_path).stem
         if (Path(input_path).suffix == '.wav'):
             audio_path = input_path
+            input_is_video = False
+        elif self.decode == 'pipe':
+            # Decoded while VAD runs, see open_decoder
+            audio_path = None
+            input_is_video = True
         else:
             # Assume input is a video
-            self.sound_data = mp.AudioFileClip(input_path)
+            sound_data = mp.AudioFileClip(input_path)
             audio_path = Path(input_path).with_suffix('.wav').as_posix()
+            if local:
+                os.makedirs(output, exist_ok=True)
+                audio_path = os.path.join(output, name + '.wav')
             try:
                 # Combine channels and set sample rate
-                self.sound_data.write_audiofile(
-                    audio_path,
-                    ffmpeg_params=['-ac', '1', '-ar', '16000'],
-                    verbose=False,
-                    logger=None)
-                self.input_is_video = True
+                with stats.stage('decode'):
+                    sound_data.write_audiofile(
+                        audio_path,
+                        ffmpeg_params=['-ac', '1', '-ar', '16000'],
+                        verbose=False,
+                        logger=None)
+                input_is_video = True
             except IndexError:
                 logging.error("No audio found in file " + input_path)
-                return
-        self.transcript_list = []
-        self.recognize(audio_path)
-        srt_data = srt.compose(self.transcript_list)
-        with open(Path(audio_path).with_suffix('.srt'), 'w') as f:
-            f.write(srt_data)
+                return None
+        if audio_path is None or local:
+            # Nothing is written next to a piped input, which may be on
+            # read-only media
+            srt_path = os.path.join(output, name + '.srt')
+        else:
+            srt_path = Path(input_path).with_suffix('.srt')
+        segment_writer = segmentWriter.open_writer(output, name,
+                                                   self.segment_format)
+        manifest = jobManifest.Manifest(
+            os.path.join(self.output, name + '.manifest.jsonl'), self.resume)
+        return Job(input_path, name, audio_path, input_is_video, output,
+                   manifest, stats, segment_writer, srt_path)
 
-    def write_vid(self, input_path, interval, out_path):
-        vid_data = mp.VideoFileClip(input_path)
-        subclip = vid_data.subclip(*interval)
-        subclip.write_videofile(out_path + ".mp4", verbose=False, logger=None)
+    def finish_input(self, job):
+        failed = job.manifest.failed()
+        if failed:
+            logging.warning("%s: %d segments failed, rerun with --resume to retry"
+                            % (job.input_path, len(failed)))
+        if job.input_is_video and job.video_intervals:
+            with job.stats.stage('write_vid'):
+                self.write_vid(job.input_path, sorted(job.video_intervals))
+        if job.gate is not None:
+            job.stats.count('vad_frames', job.gate.frames)
+            job.stats.count('vad_frames_skipped', job.gate.skipped)
+        self.write_stats(job)
 
-    def write_segment(self, segment_name, audio_data, interval, text):
-        path = os.path.join(os.getcwd(), self.output, segment_name)
+    def write_stats(self, job):
+        # Machine-readable timing summary, next to the manifest
+        summary = job.stats.summary(job.audio_duration, job.segments_done)
+        summary['input'] = job.input_path
+        with open(
+                os.path.join(self.output, job.name + '.stats.json'),
+                'w') as f:
+            json.dump(summary, f, indent=2)
+        logging.info("Stats for %s: %s" % (job.input_path, json.dumps(summary)))
 
-        # Audio clip
-        wav_data = audio_data.get_wav_data()
-        with open(path + '.wav', 'wb') as f:
-            f.write(wav_data)
+    def write_vid(self, input_path, intervals):
+        # Writes a clip for each (start, end, out_path) in intervals. The
+        # input is opened once for all of them; with stream_copy the clips
+        # are cut by ffmpeg without re-encoding instead, see copy_clips.
+        if self.stream_copy:
+            ext = Path(input_path).suffix
+            keyframes = keyframe_times(input_path)
+            for first in range(0, len(intervals), COPY_CLIPS_PER_RUN):
+                copy_clips(input_path,
+                           intervals[first:first + COPY_CLIPS_PER_RUN], ext,
+                           keyframes)
+            return
+        vid_data = mp.VideoFileClip(input_path)
+        try:
+            for start, end, out_path in intervals:
+                subclip = vid_data.subclip(start, end)
+                subclip.write_videofile(out_path + ".mp4",
+                                        verbose=False,
+                                        logger=None)
+        finally:
+            vid_data.close()
 
-        # Transcript
-        with open(path + '.txt', 'w') as f:
-            f.write(text)
+    def write_segment(self, job, segment_name, audio_data, interval, text):
+        # Audio clip and transcript
+        job.segment_writer.write_segment(segment_name, *interval, audio_data,
+                                         text)
 
-        if self.input_is_video:
-            # Video clip
-            p = Process(target=self.write_vid,
-                        args=(self.input_path, interval, path))
-            p.start()
-            p.join()
+        if job.input_is_video:
+            # Video clips are cut in one pass once all segments are done
+            with self.mutex:
+                job.video_intervals.append(
+                    (*interval, os.path.join(job.output, segment_name)))
 
-    def process_segment(self, rate, segment, start, end):
+    def process_segment(self, job, number, segment, start, end):
+        # Runs the recognizer on the job's number-th segment, unless the
+        # manifest being resumed already has it. Returns the arguments for
+        # output_segment; status is 'done', 'unintelligible' or 'failed'.
+        rate = job.sample_rate
         segment_name = "%.3f_%.3f" % (start, end)
-        audio = np.frombuffer(segment, dtype=np.int16)
-        audio_data = speech_recognition.AudioData(audio, rate, 2)
+        # The VAD buffer itself, encoded on demand and at most once per
+        # format for both the recognizer and write_segment
+        audio_data = asrBackend.SegmentAudio(segment, rate, 2)
+        entry = job.manifest.get(start, end)
+        if entry is not None:
+            logging.debug("Segment %s already %s" %
+                          (segment_name, entry['status']))
+            return (job, number, segment_name, audio_data, (start, end),
+                    entry['text'], entry['status'])
         try:
-            text = self.asr.recognize_google(audio_data, language=self.lang)
+            with job.stats.stage('process_segment', latency=True):
+                text = self.transcribe(rate, segment, audio_data)
             logging.debug("Segment %s transcript: %s" % (segment_name, text))
-            self.write_segment(segment_name, audio_data, (start, end), text)
-
-            self.mutex.acquire()
-            self.transcript_list.append(
-                srt.Subtitle(index=len(self.transcript_list) + 1,
-                             start=timedelta(seconds=start),
-                             end=timedelta(seconds=end),
-                             content=text))
-            self.mutex.release()
+            return (job, number, segment_name, audio_data, (start, end), text,
+                    'done')
         except speech_recognition.UnknownValueError:
             logging.debug("Segment %s unintelligible" % segment_name)
+            return (job, number, segment_name, audio_data, (start, end), None,
+                    'unintelligible')
+        except (speech_recognition.RequestError, socket.timeout) as e:
+            logging.error("Segment %s failed: %s" % (segment_name, e))
+            return (job, number, segment_name, audio_data, (start, end), None,
+                    'failed')
+
+    def transcribe(self, rate, segment, audio_data):
+        # Consults the transcript cache, if any, before the recognizer.
+        if self.cache is None:
+            return self.asr.recognize(audio_data, self.lang)
+        key = self.cache.key(segment, rate, self.lang, self.asr.name)
+        found, text = self.cache.get(key)
+        if not found:
+            try:
+                text = self.asr.recognize(audio_data, self.lang)
+            except speech_recognition.UnknownValueError:
+                text = None
+            self.cache.put(key, text)
+        if text is None:
+            raise speech_recognition.UnknownValueError()
+        return text
+
+    def output_segment(self, job, number, segment_name, audio_data, interval,
+                       text, status):
+        start, end = interval
+        job.segments_done += 1
+        if status == 'done':
+            with job.stats.stage('write_segment'):
+                self.write_segment(job, segment_name, audio_data, interval,
+                                   text)
+        job.manifest.record(start, end, status, text)
+        job.srt_writer.add(number, start, end,
+                           text if status == 'done' else None)
+
+    def output_segments(self, results):
+        # One batch from output_stage, all of the same job
+        for result in results:
+            self.output_segment(*result)
+        if results:
+            results[0][0].segment_writer.flush()
+
+    def process_stream(self, read, sample_rate, fmt='srt', out=sys.stdout):
+        # Transcribes live audio: read(num_bytes) returns mono 16-bit PCM
+        # as it arrives. Each segment is sent to the recognizer as soon as
+        # VAD closes it, and its subtitle written to out (SRT blocks or
+        # JSON lines) as soon as it and every earlier segment are
+        # recognized, together with latencies measured from the moment the
+        # segment's audio ended.
+        opened = time.monotonic()
+        emitted = []
+        lock = Lock()
+        writer = srtWriter.OrderedStreamWriter(out, fmt)
+
+        def emit(future, number, start, end, closed):
+            try:
+                text = future.result()
+            except Exception:
+                # Still counts as finished, so later subtitles are written
+                logging.exception("Segment %.3f_%.3f failed" % (start, end))
+                text = None
+            if text is None:
+                with lock:
+                    writer.add(number, start, end, None)
+                return
+            now = time.monotonic()
+            latency = {
+                # Segment end (in stream time) to recognized, for live
+                # sources; with threads > 1 the subtitle can then wait for
+                # earlier segments
+                'end_to_end': now - opened - end,
+                # VAD closing the segment to recognized
+                'asr': now - closed,
+            }
+            with lock:
+                emitted.append(latency)
+                writer.add(number, start, end, text, latency=latency)
+            logging.debug("Segment %.3f_%.3f latency: %.3fs end to end, "
+                          "%.3fs ASR" % (start, end, latency['end_to_end'],
+                                         latency['asr']))
+
+        # Reads of whole frames, at most STREAM_READ_MS at a time: three
+        # 10 ms frames, or a single 20 or 30 ms frame
+        frame_ms = self.vad_params['frame_duration_ms']
+        segments = wavTranscriber.pcm_segment_generator(
+            read,
+            sample_rate,
+            self.aggressive,
+            block_frames=max(1, STREAM_READ_MS // frame_ms),
+            max_segment_s=self.max_segment,
+            min_segment_s=self.min_segment,
+            gate=self.energy_gate(),
+            **self.vad_params)
+        try:
+            with ThreadPoolExecutor(self.threads) as executor:
+                for number, (segment, start, end) in enumerate(segments):
+                    closed = time.monotonic()
+                    future = executor.submit(self.recognize_live, sample_rate,
+                                             bytes(segment), start, end)
+                    future.add_done_callback(
+                        lambda f, number=number, start=start, end=end,
+                        closed=closed: emit(f, number, start, end, closed))
+        finally:
+            with lock:
+                writer.close()
+        return emitted
+
+    def recognize_live(self, rate, segment, start, end):
+        segment_name = "%.3f_%.3f" % (start, end)
+        audio_data = asrBackend.SegmentAudio(segment, rate, 2)
+        try:
+            return self.transcribe(rate, segment, audio_data)
+        except speech_recognition.UnknownValueError:
+            logging.debug("Segment %s unintelligible" % segment_name)
+        except (speech_recognition.RequestError, socket.timeout) as e:
+            logging.error("Segment %s failed: %s" % (segment_name, e))
+
+    async def run_inputs(self, input_paths, parallel_files, batch=True):
+        # All inputs share one pool of recognizer threads, so at most
+        # self.threads recognitions are in flight however many inputs are
+        # being processed, plus a thread per input for decoding and VAD
+        # and a single output thread.
+        files = asyncio.Semaphore(parallel_files)
+        names = output_names(input_paths)
+        finished = []
+        with ThreadPoolExecutor(parallel_files) as input_executor, \
+                ThreadPoolExecutor(self.threads) as asr_executor, \
+                ThreadPoolExecutor(1) as output_executor:
+            executors = (input_executor, asr_executor, output_executor)
+
+            async def run_input(input_path):
+                async with files:
+                    name = names[input_path]
+                    output = self.output
+                    if batch:
+                        output = os.path.join(self.output, name)
+                    try:
+                        job = await self.run_input(input_path, output, name,
+                                                   executors)
+                    except Exception:
+                        if not batch:
+                            raise
+                        logging.exception("Failed to transcribe " +
+                                          input_path)
+                        job = None
+                finished.append(input_path)
+                if job is None:
+                    logging.info("[%d/%d] Skipped %s" %
+                                 (len(finished), len(input_paths), input_path))
+                else:
+                    logging.info("[%d/%d] Finished %s: %d segments" %
+                                 (len(finished), len(input_paths), input_path,
+                                  job.segments_done))
+
+            await asyncio.gather(
+                *[run_input(input_path) for input_path in input_paths])
+        if self.cache is not None:
+            logging.info("Transcript cache: %d hits, %d misses" %
+                         (self.cache.hits, self.cache.misses))
+
+    async def run_input(self, input_path, output, name, executors):
+        input_executor, asr_executor, output_executor = executors
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(input_executor, self.prepare_input,
+                                         input_path, output, name)
+        if job is None:
+            return
+        try:
+            segments = await loop.run_in_executor(input_executor,
+                                                  self.open_segments, job)
+            await self.run_pipeline(job, segments, executors)
+        finally:
+            job.manifest.close()
+            job.srt_writer.close()
+            job.segment_writer.close()
+        await loop.run_in_executor(input_executor, self.finish_input, job)
+        return job
+
+    def energy_gate(self):
+        # A fresh gate, so each input counts its own skipped frames
+        if self.gate_rms is None and self.gate_peak is None:
+            return None
+        return wavSplit.EnergyGate(self.gate_rms, self.gate_peak)
+
+    def open_segments(self, job):
+        # Sets up VAD over the job's audio. Work done lazily while the
+        # segments are consumed is timed as the vad_collector stage.
+        job.gate = self.energy_gate()
+        if job.audio_path is None:
+            job.sample_rate = 16000
+            segments = self.decoded_segments(job, 16000)
+        else:
+            with job.stats.stage('read_wave'):
+                segments, job.sample_rate, job.audio_duration = \
+                    wavTranscriber.vad_segment_generator(
+                        job.audio_path, self.aggressive, reader=self.reader,
+                        engine=self.engine, workers=self.vad_workers,
+                        max_segment_s=self.max_segment,
+                        min_segment_s=self.min_segment, gate=job.gate,
+                        **self.vad_params, **self.shard_params)
+        return job.stats.time_iterator('vad_collector', segments)
+
+    def decoded_segments(self, job, sample_rate):
+        # Sets job.audio_duration from the amount of audio decoded, as
+        # there is no wav header to read it from. Raises if ffmpeg fails,
+        # so an input it could not (fully) decode is not taken as done.
+        decoder = open_decoder(job.input_path, sample_rate)
+        decoded = [0]
+
+        def read(size):
+            data = decoder.stdout.read(size)
+            decoded[0] += len(data)
+            return data
+
+        try:
+            yield from wavTranscriber.pcm_segment_generator(
+                read,
+                sample_rate,
+                self.aggressive,
+                max_segment_s=self.max_segment,
+                min_segment_s=self.min_segment,
+                gate=job.gate,
+                **self.vad_params)
+        finally:
+            decoder.stdout.close()
+            error = decoder.stderr.read().decode(errors='replace')
+            decoder.stderr.close()
+            returncode = decoder.wait()
+        if returncode != 0:
+            raise RuntimeError("Decoding %s failed: %s" %
+                               (job.input_path, error.strip()))
+        job.audio_duration = decoded[0] / (2.0 * sample_rate)
+
+    async def run_pipeline(self, job, segments, executors):
+        # VAD, recognition and output run as concurrent stages joined by
+        # bounded queues: up to self.threads recognitions are in flight
+        # while VAD looks ahead and finished segments are written, and a
+        # slow stage holds back the ones before it.
+        # If any stage fails the others are cancelled, since nothing would
+        # be left to fill or drain the queues they wait on, and the error
+        # is raised to the caller.
+        input_executor, asr_executor, output_executor = executors
+        segment_queue = asyncio.Queue(self.threads * 2)
+        result_queue = asyncio.Queue(max(self.threads * 2, self.write_batch))
+        writer = asyncio.ensure_future(
+            self.output_stage(result_queue, output_executor))
+        producers = asyncio.ensure_future(
+            self.produce_results(job, segments, segment_queue, result_queue,
+                                 input_executor, asr_executor))
+        try:
+            done, _ = await asyncio.wait([producers, writer],
+                                         return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in (producers, writer):
+                task.cancel()
+            await asyncio.gather(producers, writer, return_exceptions=True)
+
+    async def produce_results(self, job, segments, segment_queue, result_queue,
+                              input_executor, asr_executor):
+        await asyncio.gather(
+            self.vad_stage(job, segments, segment_queue, input_executor),
+            *[
+                self.asr_stage(job, segment_queue, result_queue, asr_executor)
+                for _ in range(self.threads)
+            ])
+        await result_queue.put(None)
+
+    async def vad_stage(self, job, segments, segment_queue, executor):
+        loop = asyncio.get_running_loop()
+        segments = iter(segments)
+        number = 0
+        while True:
+            segment = await loop.run_in_executor(executor, next, segments,
+                                                 None)
+            if segment is None:
+                break
+            await segment_queue.put((number, *segment))
+            number += 1
+            job.stats.sample_queue('segments', segment_queue.qsize())
+        # One end marker per recognizer
+        for _ in range(self.threads):
+            await segment_queue.put(None)
+
+    async def asr_stage(self, job, segment_queue, result_queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            segment = await segment_queue.get()
+            if segment is None:
+                break
+            result = await loop.run_in_executor(executor, self.process_segment,
+                                                job, *segment)
+            await result_queue.put(result)
+            job.stats.sample_queue('results', result_queue.qsize())
+
+    async def output_stage(self, result_queue, executor):
+        # Writes results in batches of whatever queued up while the previous
+        # batch was being written, up to self.write_batch, so recognizer
+        # threads only ever wait for queue space, never for the disk.
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            results = [await result_queue.get()]
+            while (len(results) < self.write_batch and
+                   not result_queue.empty()):
+                results.append(result_queue.get_nowait())
+            if results[-1] is None:
+                finished = True
+                results.pop()
+            await loop.run_in_executor(executor, self.output_segments, results)
+
+
+def copy_clips(input_path, intervals, ext, keyframes):
+    # One ffmpeg run writing every (start, end, out_path) clip as its own
+    # output, so the input is opened and demuxed once. It seeks to the first
+    # clip, and each output then selects its span relative to that point.
+    # A stream copy can only start at a keyframe, so clips start at the
+    # last keyframe before their start, as an input seek would.
+    starts = [keyframe_before(start, keyframes) for start, _, _ in intervals]
+    offset = min(pts for pts, _ in starts)
+    cmd = [get_setting("FFMPEG_BINARY"), '-y', '-v', 'error', '-ss',
+           '%.3f' % offset, '-i', input_path]
+    for (_, dts), (_, end, out_path) in zip(starts, intervals):
+        # The copy starts at the first packet whose decoding time is past
+        # -ss, so the keyframe's decoding time is used, rounded down to
+        # keep it
+        start = math.floor((dts - offset) * 1000) / 1000
+        if start > 0:
+            cmd += ['-ss', '%.3f' % start]
+        cmd += ['-to', '%.3f' % (end - offset), '-map', '0', '-c', 'copy',
+                out_path + ext]
+    subprocess.run(cmd, stdin=subprocess.DEVNULL, check=True)
+
+
+def keyframe_times(input_path):
+    # (presentation, decoding) times of the first video stream's keyframes,
+    # from a stream copy pass (no decoding); empty if there is no video.
+    cmd = [get_setting("FFMPEG_BINARY"), '-v', 'error', '-i', input_path,
+           '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+                            capture_output=True)
+    if result.returncode != 0:
+        return []
+    time_base = 1.0
+    times = []
+    for line in result.stdout.decode(errors='replace').splitlines():
+        if line.startswith('#tb 0:'):
+            num, den = line.split(':')[1].strip().split('/')
+            time_base = int(num) / int(den)
+        elif not line.startswith('#'):
+            # stream, dts, pts, duration, size, crc[, F=flags]; only
+            # packets other than plain keyframes carry flags
+            fields = [f.strip() for f in line.split(',')]
+            if len(fields) == 6:
+                times.append((int(fields[2]) * time_base,
+                              int(fields[1]) * time_base))
+    return sorted(times)
+
+
+def keyframe_before(start, keyframes):
+    # (pts, dts) of the last keyframe at or before start, or start itself
+    i = bisect.bisect_right(keyframes, (start + 0.0005, math.inf))
+    return keyframes[i - 1] if i else (start, start)
+
 
-    def worker(self, args):
-        # Called by thread pool
-        self.process_segment(self.sample_rate, *args)
+# Largest read from a live source, in ms; longer reads add latency
+STREAM_READ_MS = 30
 
-    def recognize(self, waveFile):
-        segments, sample_rate, _ = wavTranscriber.vad_segment_generator(
-            waveFile, self.aggressive)
-        self.sample_rate = sample_rate
+# Clips per ffmpeg run, to keep its command line well within OS limits
+COPY_CLIPS_PER_RUN = 200
 
-        p = multiprocessing.dummy.Pool(self.threads)
-        p.map(self.worker, segments)
+
+def open_decoder(input_path, sample_rate):
+    # ffmpeg writing the input's audio to stdout as mono 16-bit PCM
+    cmd = [
+        get_setting("FFMPEG_BINARY"), '-v', 'error', '-i', input_path, '-vn',
+        '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-'
+    ]
+    return subprocess.Popen(cmd,
+                            stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+
+def open_source(source, sample_rate):
+    # Returns (read, close) for a live source: 'mic' for the default input
+    # device, '-' for raw mono 16-bit PCM on stdin, or the path of a file
+    # or named pipe carrying the same.
+    if source == 'mic':
+        # Optional dependency, only needed for microphone input
+        import pyaudio
+        pa = pyaudio.PyAudio()
+        stream = pa.open(format=pyaudio.paInt16,
+                         channels=1,
+                         rate=sample_rate,
+                         input=True,
+                         frames_per_buffer=sample_rate // 100)
+
+        def close():
+            stream.stop_stream()
+            stream.close()
+            pa.terminate()
+
+        return (lambda size: stream.read(size // 2,
+                                         exception_on_overflow=False), close)
+    f = sys.stdin.buffer if source == '-' else open(source, 'rb')
+    return f.read, f.close
+
+
+def expand_inputs(spec):
+    # A directory, a glob pattern, or a text file listing one input per line
+    if os.path.isdir(spec):
+        return sorted(
+            os.path.join(spec, name) for name in os.listdir(spec)
+            if Path(name).suffix.lower() in INPUT_SUFFIXES)
+    if os.path.isfile(spec) and Path(spec).suffix in ('.txt', '.lst'):
+        with open(spec) as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(glob.glob(spec))
+
+
+def output_names(input_paths):
+    # Base name of each input's outputs (segment directory, manifest, stats,
+    # SRT): its stem, unless another input has the same stem, in which case
+    # its path relative to the inputs' common directory with separators
+    # replaced, such as a_talk.wav and b_talk.wav for a/talk.wav and
+    # b/talk.wav. Inputs that still share a name are rejected.
+    stems = {}
+    for input_path in input_paths:
+        stems.setdefault(Path(input_path).stem, []).append(input_path)
+    names = {}
+    for stem, paths in stems.items():
+        if len(paths) == 1:
+            names[paths[0]] = stem
+            continue
+        absolute = [os.path.abspath(path) for path in paths]
+        common = os.path.commonpath([os.path.dirname(path)
+                                     for path in absolute])
+        for path, full in zip(paths, absolute):
+            names[path] = os.path.relpath(full, common).replace(os.sep, '_')
+    seen = {}
+    for input_path in input_paths:
+        name = names[input_path]
+        if name in seen:
+            raise ValueError("Inputs %s and %s would share output name %s" %
+                             (seen[name], input_path, name))
+        seen[name] = input_path
+    return names
+
+
+INPUT_SUFFIXES = ('.wav', '.mp4', '.mkv', '.mov', '.avi', '.webm')
 
 
 def main(args):
     if args.stream is True:
-        print("Opening mic for streaming")
+        logging.info("Opening %s for streaming" % args.source)
     elif args.audio is not None:
         logging.debug("Transcribing audio file @ %s" % args.audio)
+    elif args.batch is not None:
+        logging.debug("Transcribing batch @ %s" % args.batch)
     else:
         parser.print_help()
         parser.exit()
 
-    if args.audio is not None:
+    if args.stream or args.audio is not None or args.batch is not None:
         vs = AudioVideoSplitter(args.aggressive, args.lang, args.out,
-                                args.threads)
+                                args.threads, args.reader, args.engine,
+                                args.vad_workers, args.stream_copy,
+                                args.backend, args.timeout, args.retries,
+                                args.rate, args.cache, args.cache_size,
+                                args.resume, args.decode, args.max_segment,
+                                args.min_segment, args.segment_format,
+                                args.write_batch, args.gate_rms,
+                                args.gate_peak, args.frame_ms, args.padding_ms,
+                                args.start_percentage, args.stop_percentage,
+                                args.shard_s, args.overlap_s)
+    if args.stream:
+        read, close = open_source(args.source, args.sample_rate)
+        try:
+            vs.process_stream(read, args.sample_rate, args.format)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close()
+    elif args.audio is not None:
         vs.process_input(args.audio)
+    elif args.batch is not None:
+        vs.process_batch(expand_inputs(args.batch), args.parallel_files)
 
 
 import argparse
@@ -147,13 +739,59 @@ if __name__ == '__main__':
     parser.add_argument('--audio',
                         required=False,
                         help='Path to the input audio (WAV format) or video.')
+    parser.add_argument('--batch',
+                        required=False,
+                        help='Directory, glob pattern or list file (.txt) of inputs to transcribe together')
+    parser.add_argument('--parallel_files',
+                        default=2,
+                        type=int,
+                        help='Number of batch inputs decoded and segmented at once')
     parser.add_argument('--stream',
                         required=False,
                         action='store_true',
                         help='To use microphone input')
+    parser.add_argument('--source',
+                        default='mic',
+                        help='Streaming input: mic, - for raw 16-bit mono PCM on stdin, or a file/pipe of it')
+    parser.add_argument('--sample_rate',
+                        default=16000,
+                        type=int,
+                        choices=[8000, 16000, 32000],
+                        help='Sample rate of the streaming input')
+    parser.add_argument('--format',
+                        default='srt',
+                        choices=['srt', 'json'],
+                        help='Streaming output written to stdout: SRT blocks or JSON lines')
     parser.add_argument('--lang',
                         default='en-US',
                         help='Language option for running ASR.')
+    parser.add_argument('--backend',
+                        default='google',
+                        choices=sorted(asrBackend.BACKENDS),
+                        help='Speech recognizer: google (network), sphinx (local, offline) or stub (deterministic, for benchmarking)')
+    parser.add_argument('--timeout',
+                        default=None,
+                        type=float,
+                        help='Seconds to wait for each ASR response')
+    parser.add_argument('--retries',
+                        default=3,
+                        type=int,
+                        help='Times a failed ASR request is retried, with exponential backoff')
+    parser.add_argument('--rate',
+                        default=None,
+                        type=float,
+                        help='Maximum ASR requests per second across all threads')
+    parser.add_argument('--cache',
+                        default=None,
+                        help='Directory of a transcript cache shared between runs')
+    parser.add_argument('--cache_size',
+                        default=100,
+                        type=int,
+                        help='Transcript cache size limit in MB')
+    parser.add_argument('--resume',
+                        required=False,
+                        action='store_true',
+                        help='Skip segments finished by a previous, interrupted run of the same input')
     parser.add_argument('--out',
                         required=False,
                         help='Output directory',
@@ -163,5 +801,100 @@ if __name__ == '__main__':
                         type=int,
                         required=False,
                         help='Number of concurrent voice segments to process')
+    parser.add_argument(
+        '--reader',
+        default='memory',
+        choices=['memory', 'stream', 'mmap'],
+        help=
+        'How the wav file is read: all at once, streamed in blocks to bound memory use, or memory-mapped'
+    )
+    parser.add_argument(
+        '--engine',
+        default='collector',
+        choices=['collector', 'numpy'],
+        help=
+        'VAD segmentation engine: frame-by-frame state machine, or vectorized two-phase pass'
+    )
+    parser.add_argument(
+        '--frame_ms',
+        default=10,
+        type=int,
+        choices=[10, 20, 30],
+        help='VAD frame length in ms; longer frames mean fewer VAD calls but coarser boundaries (see tools/vad_sweep.py)')
+    parser.add_argument(
+        '--padding_ms',
+        default=300,
+        type=int,
+        help='Length of the VAD sliding window in ms')
+    parser.add_argument(
+        '--start_percentage',
+        default=0.85,
+        type=float,
+        help='Fraction of voiced frames in the window that starts a segment')
+    parser.add_argument(
+        '--stop_percentage',
+        default=0.20,
+        type=float,
+        help='Fraction of unvoiced frames in the window that ends a segment')
+    parser.add_argument(
+        '--max_segment',
+        default=None,
+        type=float,
+        help='Split segments longer than this many seconds at their quietest point')
+    parser.add_argument(
+        '--min_segment',
+        default=None,
+        type=float,
+        help='Merge segments shorter than this many seconds with a neighbour')
+    parser.add_argument(
+        '--gate_rms',
+        default=None,
+        type=float,
+        help='Skip VAD on frames whose RMS amplitude (16-bit units) is at most this, and whose peak is at most --gate_peak if given')
+    parser.add_argument(
+        '--gate_peak',
+        default=None,
+        type=float,
+        help='Skip VAD on frames whose peak amplitude is at most this (0 skips only digital silence). Segments can still change: webrtcvad adapts to what it is given, and at 20/30 ms frames a segment after a long silence can end earlier')
+    parser.add_argument(
+        '--vad_workers',
+        default=1,
+        type=int,
+        required=False,
+        help='Number of processes running VAD over shards of the input; segment boundaries then only approximate a single-process run')
+    parser.add_argument(
+        '--shard_s',
+        default=600,
+        type=float,
+        help='Length in seconds of the shards given to each VAD process')
+    parser.add_argument(
+        '--overlap_s',
+        default=300,
+        type=float,
+        help='Seconds of preceding audio each shard\'s VAD warms up on; longer is closer to a single-process run')
+    parser.add_argument(
+        '--decode',
+        default='wav',
+        choices=['wav', 'pipe'],
+        help=
+        'For video inputs, write a 16 kHz wav next to the input first, or pipe decoded audio straight into VAD (the SRT then goes to the output directory)'
+    )
+    parser.add_argument(
+        '--stream_copy',
+        required=False,
+        action='store_true',
+        help='Cut video clips without re-encoding (cuts snap to keyframes)')
+    parser.add_argument(
+        '--segment_format',
+        default='files',
+        choices=segmentWriter.FORMATS,
+        help=
+        'How segment audio and transcripts are stored: a .wav and .txt per segment, one zip per input, or one indexed pack file per input (see segmentPack.py)'
+    )
+    parser.add_argument(
+        '--write_batch',
+        default=16,
+        type=int,
+        help='Maximum number of finished segments written out at a time')
     args = parser.parse_args()
     main(args)
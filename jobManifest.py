@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+
+from threading import Lock
+
+
+class Manifest(object):
+    """Checkpoint of the segments of one input that have been processed.
+
+    Each finished segment is appended as a JSON line with its interval,
+    status ('done', 'unintelligible' or 'failed') and transcript, and
+    flushed immediately, so the record survives the process being killed.
+    With resume, an existing manifest is loaded first and appended to.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.entries = {}
+        self.lock = Lock()
+        line = '\n'
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by the interruption
+                        logging.warning("Skipping corrupt manifest line in %s"
+                                        % path)
+                        continue
+                    self.entries[self.key(entry['start'],
+                                          entry['end'])] = entry
+            logging.info("Resuming from %s: %d segments finished" %
+                         (path, len(self.completed())))
+        self.file = open(path, 'a' if resume else 'w')
+        if not line.endswith('\n'):
+            # Start after the partial line, not on it
+            self.file.write('\n')
+
+    @staticmethod
+    def key(start, end):
+        return "%.3f_%.3f" % (start, end)
+
+    def get(self, start, end):
+        """Returns the entry of a segment that does not need redoing, or None."""
+        entry = self.entries.get(self.key(start, end))
+        if entry is None or entry['status'] == 'failed':
+            return None
+        return entry
+
+    def completed(self):
+        return [e for e in self.entries.values() if e['status'] != 'failed']
+
+    def failed(self):
+        return [e for e in self.entries.values() if e['status'] == 'failed']
+
+    def record(self, start, end, status, text):
+        entry = {'start': start, 'end': end, 'status': status, 'text': text}
+        key = self.key(start, end)
+        with self.lock:
+            if self.entries.get(key) == entry:
+                return
+            self.entries[key] = entry
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
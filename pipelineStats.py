@@ -0,0 +1,100 @@
+import contextlib
+import time
+
+from collections import defaultdict
+from threading import Lock
+
+import numpy as np
+
+
+class PipelineStats(object):
+    """Timing and throughput figures for one input. Safe to share between
+    threads.
+
+    Stages are timed with stage() or time_iterator(); recognizer calls
+    additionally record their latency, queue depths are sampled with
+    sample_queue() and other totals kept with count(). summary() returns
+    everything as a JSON-serialisable dict.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.latencies = []
+        self.queue_depths = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    @contextlib.contextmanager
+    def stage(self, name, latency=False):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started, latency)
+
+    def add(self, name, seconds, latency=False):
+        with self.lock:
+            self.stage_seconds[name] += seconds
+            self.stage_calls[name] += 1
+            if latency:
+                self.latencies.append(seconds)
+
+    def time_iterator(self, name, iterable):
+        # Times each step of a lazy iterable, e.g. a segment generator
+        # whose work happens as it is consumed.
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def sample_queue(self, name, depth):
+        with self.lock:
+            self.queue_depths[name].append(depth)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def summary(self, audio_duration=None, segments=0):
+        with self.lock:
+            wall_time = time.monotonic() - self.started
+            summary = {
+                'wall_time': wall_time,
+                'audio_duration': audio_duration,
+                # Processing time per second of audio, < 1 is faster than
+                # real time
+                'realtime_factor':
+                wall_time / audio_duration if audio_duration else None,
+                'segments': segments,
+                'segments_per_second': segments / wall_time,
+                'stages': {
+                    name: {
+                        'seconds': self.stage_seconds[name],
+                        'calls': self.stage_calls[name]
+                    }
+                    for name in self.stage_seconds
+                },
+                'queue_depth': {
+                    name: {
+                        'mean': float(np.mean(depths)),
+                        'max': int(np.max(depths))
+                    }
+                    for name, depths in self.queue_depths.items()
+                },
+                'counters': dict(self.counters),
+            }
+            if self.latencies:
+                p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99])
+                summary['asr_latency'] = {
+                    'mean': float(np.mean(self.latencies)),
+                    'p50': float(p50),
+                    'p95': float(p95),
+                    'p99': float(p99),
+                }
+            return summary
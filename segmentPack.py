@@ -0,0 +1,155 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Layout of a segment pack (all little-endian):
+#   header   MAGIC, sample rate, sample width, channels, segment count and
+#            index offset, see HEADER
+#   audio    raw PCM of every segment, back to back
+#   index    one INDEX_DTYPE record per segment, sorted by start time
+#   texts    UTF-8 transcripts, back to back
+# Offsets are absolute positions in the file.
+MAGIC = b'VADPACK1'
+HEADER = struct.Struct('<8sIHHQQ')
+INDEX_DTYPE = np.dtype([('start', '<f8'), ('end', '<f8'), ('offset', '<u8'),
+                        ('length', '<u8'), ('text_offset', '<u8'),
+                        ('text_length', '<u8')])
+
+
+class PackWriter(object):
+    """Writes segments of one input into a single pack file.
+
+    Audio is appended as segments arrive, in any order; the index and
+    transcripts are written by close(), so a pack that was not closed
+    cannot be read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.file.write(b'\0' * HEADER.size)
+        self.format = None
+        self.records = []
+        self.texts = []
+        self.text_length = 0
+
+    def write_segment(self, name, start, end, audio_data, text):
+        pcm = audio_data.get_raw_data()
+        if self.format is None:
+            self.format = (audio_data.sample_rate, audio_data.sample_width)
+        elif self.format != (audio_data.sample_rate, audio_data.sample_width):
+            raise ValueError("Segment %s does not match the pack's format" %
+                             name)
+        offset = self.file.tell()
+        self.file.write(pcm)
+        text = text.encode('utf-8')
+        self.records.append((start, end, offset, self.file.tell() - offset,
+                             self.text_length, len(text)))
+        self.texts.append(text)
+        self.text_length += len(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        index = np.array(self.records, dtype=INDEX_DTYPE)
+        index = index[np.argsort(index['start'], kind='stable')]
+        # Keep the index 8-byte aligned for mapping
+        self.file.write(b'\0' * (-self.file.tell() % 8))
+        index_offset = self.file.tell()
+        text_offset = index_offset + index.nbytes
+        index['text_offset'] += text_offset
+        self.file.write(index.tobytes())
+        for text in self.texts:
+            self.file.write(text)
+        sample_rate, sample_width = self.format or (0, 2)
+        self.file.seek(0)
+        self.file.write(
+            HEADER.pack(MAGIC, sample_rate, sample_width, 1, len(index),
+                        index_offset))
+        self.file.close()
+
+
+class PackReader(object):
+    """Random access to the segments of a pack file.
+
+    The file is memory-mapped: opening it reads only the header, index is
+    a structured numpy view of the on-disk index, and audio(i) is a
+    zero-copy memoryview of a segment's PCM. Views can be kept after the
+    reader is closed, and keep the file mapped until they are freed.
+
+        with PackReader('out/talk.segments.pack') as pack:
+            for start, end, pcm, text in pack:
+                ...
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.sample_rate, self.sample_width, self.channels, count, \
+            index_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError("%s is not a segment pack" % path)
+        self.index = np.frombuffer(self.map, dtype=INDEX_DTYPE, count=count,
+                                   offset=index_offset)
+        self.data = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        return (float(record['start']), float(record['end']), self.audio(i),
+                self.text(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def audio(self, i):
+        record = self.index[i]
+        offset = int(record['offset'])
+        return self.data[offset:offset + int(record['length'])]
+
+    def text(self, i):
+        record = self.index[i]
+        offset = int(record['text_offset'])
+        return bytes(self.data[offset:offset +
+                               int(record['text_length'])]).decode('utf-8')
+
+    def find(self, time):
+        # Position of the segment containing time, or None
+        i = int(np.searchsorted(self.index['start'], time, side='right')) - 1
+        if i >= 0 and time < self.index['end'][i]:
+            return i
+        return None
+
+    def close(self):
+        # Views handed out (segment audio, index rows) may outlive the
+        # reader. While any exists the map cannot be closed; it is then
+        # unmapped once the last of them is freed.
+        if self.map is None:
+            return
+        self.index = None
+        self.data.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+        self.data = self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_pack(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
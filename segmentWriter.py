@@ -0,0 +1,79 @@
+import os
+import zipfile
+
+import segmentPack
+
+
+class FileWriter(object):
+    # Stores each segment as <name>.wav and <name>.txt
+
+    def write_segment(self, name, start, end, audio_data, text):
+        self.write(name + '.wav', audio_data.get_wav_data())
+        self.write(name + '.txt', text.encode('utf-8'))
+
+
+class DirectoryWriter(FileWriter):
+    """Writes segment files into one output directory.
+
+    The directory is opened once and files are created relative to that
+    handle, so the path is not resolved again for every file written.
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dir_fd = None
+        if os.open in os.supports_dir_fd:
+            self.dir_fd = os.open(path, os.O_RDONLY)
+
+    def write(self, name, data):
+        if self.dir_fd is None:
+            name = os.path.join(self.path, name)
+        fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666,
+                     dir_fd=self.dir_fd)
+        with open(fd, 'wb') as f:
+            f.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.dir_fd is not None:
+            os.close(self.dir_fd)
+            self.dir_fd = None
+
+
+class ZipWriter(FileWriter):
+    """Packs segment files into a single uncompressed zip archive instead
+    of creating two small files per segment.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+
+    def write(self, name, data):
+        self.archive.writestr(name, data)
+
+    def flush(self):
+        self.archive.fp.flush()
+
+    def close(self):
+        self.archive.close()
+
+
+FORMATS = ('files', 'zip', 'pack')
+
+
+def open_writer(output, stem, fmt='files'):
+    # Segments of one input: files in output, or output/<stem>.segments.zip
+    # or output/<stem>.segments.pack (see segmentPack)
+    if fmt == 'files':
+        return DirectoryWriter(output)
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, stem + '.segments.' + fmt)
+    if fmt == 'zip':
+        return ZipWriter(path)
+    if fmt == 'pack':
+        return segmentPack.PackWriter(path)
+    raise ValueError("Unknown segment format: %s" % fmt)
@@ -0,0 +1,80 @@
+import json
+from datetime import timedelta
+
+import srt
+
+
+class OrderedSrtWriter(object):
+    """Writes subtitles to an .srt file in time order while a job runs.
+
+    Segments are numbered 0, 1, 2, ... in the order VAD produced them, but
+    may finish in any order. A finished segment waits in a reorder buffer
+    until every earlier one has finished, and is then appended to the file
+    with the next subtitle index, so the file is always a valid, ordered
+    prefix of the final transcript. Segments without a transcript
+    (unintelligible or failed) still count as finished but add no
+    subtitle.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.pending = {}
+        self.next_segment = 0
+        self.count = 0
+
+    def add(self, number, start, end, text, **fields):
+        # fields are passed on to write() with the subtitle
+        self.pending[number] = (start, end, text, fields)
+        while self.next_segment in self.pending:
+            start, end, text, fields = self.pending.pop(self.next_segment)
+            self.next_segment += 1
+            if text is None:
+                continue
+            self.count += 1
+            self.write(srt.Subtitle(index=self.count,
+                                    start=timedelta(seconds=start),
+                                    end=timedelta(seconds=end),
+                                    content=text), fields)
+        self.file.flush()
+
+    def write(self, subtitle, fields):
+        self.file.write(subtitle.to_srt())
+
+    def drain(self):
+        while self.pending:
+            # Only after an error: keep what was held back, in order.
+            self.next_segment = min(self.pending)
+            start, end, text, fields = self.pending.pop(self.next_segment)
+            self.add(self.next_segment, start, end, text, **fields)
+
+    def close(self):
+        self.drain()
+        self.file.close()
+
+
+class OrderedStreamWriter(OrderedSrtWriter):
+    """Writes the subtitles of a live transcription to an open stream, as
+    SRT blocks or, with fmt='json', JSON lines that also carry the fields
+    given to add(). Ordered like OrderedSrtWriter; close() leaves the
+    stream open.
+    """
+
+    def __init__(self, out, fmt='srt'):
+        self.file = out
+        self.fmt = fmt
+        self.pending = {}
+        self.next_segment = 0
+        self.count = 0
+
+    def write(self, subtitle, fields):
+        if self.fmt != 'json':
+            return super().write(subtitle, fields)
+        line = dict(index=subtitle.index,
+                    start=subtitle.start.total_seconds(),
+                    end=subtitle.end.total_seconds(),
+                    text=subtitle.content,
+                    **fields)
+        self.file.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.drain()
@@ -0,0 +1,219 @@
+"""Benchmarks the VAD and segmentation hot paths on synthetic audio.
+
+Synthesizes reproducible PCM inputs, runs every segmentation
+implementation on each in a fresh process, and reports frames/s, peak
+RSS (of that process, not of the sharded implementation's workers) and
+whether the segment boundaries agree with the reference
+(in-memory collector). Optionally runs the whole AudioVideoSplitter with
+the stub recognizer, so it works offline.
+
+    $ python tools/benchmark_vad.py --duration 60 3600 --rate 16000 --e2e
+"""
+import argparse, json, logging, os, sys, tempfile, time, wave
+import multiprocessing
+import resource
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+IMPLEMENTATIONS = {
+    'memory': dict(reader='memory'),
+    'stream': dict(reader='stream'),
+    'mmap': dict(reader='mmap'),
+    'numpy': dict(reader='memory', engine='numpy'),
+    'mmap-numpy': dict(reader='mmap', engine='numpy'),
+    'sharded': dict(workers=4),
+}
+
+
+def synthesize(path, duration, sample_rate, pattern, seed=0):
+    """Writes duration seconds of mono 16-bit audio, one second at a time.
+
+    pattern is silence, tone, noise, or speech: harmonic bursts with a
+    syllable-rate envelope alternating with noisy pauses.
+    """
+    rng = np.random.default_rng(seed)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        voiced = False
+        run_left = 0
+        f0 = 150.0
+        for second in range(int(duration)):
+            t = second + np.arange(sample_rate) / float(sample_rate)
+            if pattern == 'silence':
+                block = np.zeros(sample_rate)
+            elif pattern == 'tone':
+                block = 8000 * np.sin(2 * np.pi * 440 * t)
+            elif pattern == 'noise':
+                block = rng.normal(0, 2000, sample_rate)
+            else:
+                if run_left <= 0:
+                    voiced = not voiced
+                    run_left = int(rng.integers(1, 5))
+                    f0 = rng.uniform(100, 250)
+                run_left -= 1
+                block = rng.normal(0, 30, sample_rate)
+                if voiced:
+                    harmonics = sum(
+                        np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 8))
+                    block += 3000 * harmonics * (0.5 +
+                                                 0.5 * np.sin(2 * np.pi * 4 * t))
+            pcm = np.clip(block, -32768, 32767).astype('<i2')
+            wf.writeframes(pcm.tobytes())
+
+
+def run_implementation(args):
+    # Runs in a fresh process so peak RSS is per implementation
+    path, aggressive, params = args
+    import wavTranscriber
+    started = time.perf_counter()
+    segments, sample_rate, duration = wavTranscriber.vad_segment_generator(
+        path, aggressive, **params)
+    boundaries = [(round(start, 3), round(end, 3))
+                  for _, start, end in segments]
+    elapsed = time.perf_counter() - started
+    return boundaries, elapsed, duration, peak_rss_kb()
+
+
+def peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so a spawned process would report
+    # at least its parent's peak; VmHWM starts afresh with the new image.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_end_to_end(path, aggressive, threads, latency):
+    # Whole pipeline with the stub recognizer; returns its stats summary.
+    import audioTranscript_cmd
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as output:
+        vs = audioTranscript_cmd.AudioVideoSplitter(aggressive, 'en-US',
+                                                    output, threads,
+                                                    backend='stub')
+        vs.asr.backend.latency = latency
+        vs.process_input(path)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with open(os.path.join(output, stem + '.stats.json')) as f:
+            return json.load(f)
+
+
+def benchmark(args):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rate in args.rate:
+            for duration in args.duration:
+                path = os.path.join(workdir,
+                                    '%s_%d_%d.wav' % (args.pattern, rate,
+                                                      duration))
+                synthesize(path, duration, rate, args.pattern, args.seed)
+                reference = None
+                for name in args.impl:
+                    params = dict(IMPLEMENTATIONS[name])
+                    if 'workers' in params:
+                        params['workers'] = args.workers
+                        params['shard_duration_s'] = args.shard_s
+                        params['overlap_duration_s'] = args.overlap_s
+                    # Not a multiprocessing.Pool: the sharded implementation
+                    # starts its own pool, which daemonic workers cannot.
+                    with ProcessPoolExecutor(1, mp_context=context) as pool:
+                        boundaries, elapsed, audio_length, peak_kb = pool.submit(
+                            run_implementation,
+                            (path, args.aggressive, params)).result()
+                    if reference is None:
+                        reference = boundaries
+                    results.append({
+                        'rate': rate,
+                        'duration': duration,
+                        'implementation': name,
+                        'seconds': elapsed,
+                        'frames_per_second': audio_length * 100 / elapsed,
+                        'peak_rss_mb': peak_kb / 1024.0,
+                        'segments': len(boundaries),
+                        'matches_reference': boundaries == reference,
+                    })
+                    print_row(results[-1])
+                if args.e2e:
+                    stats = run_end_to_end(path, args.aggressive, args.threads,
+                                           args.latency)
+                    results.append({
+                        'rate': rate,
+                        'duration': duration,
+                        'implementation': 'end-to-end',
+                        'seconds': stats['wall_time'],
+                        'segments': stats['segments'],
+                        'stats': stats,
+                    })
+                    print("%6d Hz %8ds  end-to-end  %8.2fs  RTF %.4f  "
+                          "%d segments" %
+                          (rate, duration, stats['wall_time'],
+                           stats['realtime_factor'], stats['segments']))
+    return results
+
+
+def print_row(row):
+    print("%6d Hz %8ds  %-11s %8.2fs %12.0f frames/s %8.1f MB  "
+          "%5d segments  %s" %
+          (row['rate'], row['duration'], row['implementation'],
+           row['seconds'], row['frames_per_second'], row['peak_rss_mb'],
+           row['segments'], 'ok' if row['matches_reference'] else 'DIFFERS'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark VAD segmentation on synthetic audio.')
+    parser.add_argument('--duration',
+                        nargs='+',
+                        type=int,
+                        default=[60, 600, 1500],
+                        help='Input durations in seconds (1 min to 10 h); '
+                        'the sharded implementation only differs from the '
+                        'others on inputs longer than --shard_s')
+    parser.add_argument('--rate',
+                        nargs='+',
+                        type=int,
+                        choices=[8000, 16000, 32000],
+                        default=[16000])
+    parser.add_argument('--pattern',
+                        choices=['speech', 'silence', 'tone', 'noise'],
+                        default='speech')
+    parser.add_argument('--impl',
+                        nargs='+',
+                        choices=sorted(IMPLEMENTATIONS),
+                        default=['memory', 'stream', 'mmap', 'numpy',
+                                 'mmap-numpy', 'sharded'],
+                        help='Implementations to run; the first is the reference')
+    parser.add_argument('--aggressive', type=int, default=1, choices=range(4))
+    parser.add_argument('--workers',
+                        type=int,
+                        default=4,
+                        help='Processes for the sharded implementation')
+    parser.add_argument('--shard_s', type=float, default=600)
+    parser.add_argument('--overlap_s', type=float, default=300)
+    parser.add_argument('--e2e',
+                        action='store_true',
+                        help='Also run the full pipeline with the stub recognizer')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.0,
+                        help='Simulated recognizer latency in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    results = benchmark(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,89 @@
+"""Checks that wavSplit.PcmConverter does not alias when downsampling.
+
+For each input rate, converts a full-scale tone above the target Nyquist
+frequency (which plain interpolation would fold into the speech band) and
+a tone well inside the passband, and fails unless the first is attenuated
+by at least --min_db and the second passes within 1 dB. Also checks that
+the output does not depend on the chunk sizes it was converted in,
+including chunks smaller than one sample frame.
+
+    $ python tools/check_resampler.py
+"""
+import argparse, itertools, os, sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import wavSplit
+
+
+# Byte counts of successive chunks, repeated; the mixed one has chunks
+# that do not complete a sample frame
+CHUNKINGS = ((2,), (4098,), (1, 1, 3, 5001), (None,))
+
+
+def convert(samples, sample_rate, target_rate, chunk_sizes):
+    converter = wavSplit.PcmConverter(sample_rate, 1, 2, target_rate)
+    data = np.rint(samples).astype('<i2').tobytes()
+    out = []
+    position = 0
+    for size in itertools.cycle(chunk_sizes):
+        if position >= len(data):
+            break
+        size = size or len(data)
+        out.append(converter.convert(data[position:position + size]))
+        position += size
+    out.append(converter.flush())
+    return np.frombuffer(b''.join(out), '<i2').astype(np.float64)
+
+
+def rms(samples):
+    # Ignoring the edges, where the filter starts and stops
+    middle = samples[len(samples) // 4:-len(samples) // 4]
+    return np.sqrt(np.mean(middle**2))
+
+
+def check(sample_rate, target_rate, min_db):
+    t = np.arange(2 * sample_rate) / float(sample_rate)
+    failures = []
+    for name, freq in (('stopband', 0.75 * target_rate),
+                       ('passband', 0.2 * target_rate)):
+        if freq >= sample_rate / 2.0:
+            continue
+        tone = 16000 * np.sin(2 * np.pi * freq * t)
+        outputs = [convert(tone, sample_rate, target_rate, chunks)
+                   for chunks in CHUNKINGS]
+        if not all(np.array_equal(outputs[0], o) for o in outputs[1:]):
+            failures.append('%s output depends on chunk size' % name)
+        gain = 20 * np.log10(max(rms(outputs[0]), 1e-9) / rms(tone))
+        print("%6d -> %5d Hz  %5.0f Hz tone  %7.1f dB" %
+              (sample_rate, target_rate, freq, gain))
+        if name == 'stopband' and gain > -min_db:
+            failures.append('%.0f Hz tone only attenuated by %.1f dB' %
+                            (freq, -gain))
+        if name == 'passband' and abs(gain) > 1:
+            failures.append('%.0f Hz tone changed by %.1f dB' % (freq, gain))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Check the resampler for aliasing.')
+    parser.add_argument('--rates',
+                        nargs='+',
+                        type=int,
+                        default=[22050, 44100, 48000, 96000])
+    parser.add_argument('--target', type=int, default=16000,
+                        choices=wavSplit.VAD_SAMPLE_RATES)
+    parser.add_argument('--min_db',
+                        type=float,
+                        default=60,
+                        help='Required attenuation of the stopband tone')
+    args = parser.parse_args()
+    failures = []
+    for rate in args.rates:
+        failures += check(rate, args.target, args.min_db)
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
@@ -1,9 +1,14 @@
 from pathlib import Path
-import argparse, glob, os, re
+import argparse, glob, os, re, sys
 
+import numpy as np
 import pyaudio
 import wave
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import segmentPack
+
 # https://stackoverflow.com/a/4623518
 def tryint(s):
     try:
@@ -24,9 +29,33 @@ def sort_nicely(l):
     l.sort(key=alphanum_key)
 
 
+def play_pack(path, at):
+    # Segments from a .segments.pack file, starting with the one at `at` s
+    with segmentPack.PackReader(path) as pack:
+        first = pack.find(at) if at else 0
+        if first is None:
+            first = int(np.searchsorted(pack.index['start'], at))
+        p = pyaudio.PyAudio()
+        stream = p.open(format=p.get_format_from_width(pack.sample_width),
+                        channels=pack.channels, rate=pack.sample_rate,
+                        output=True)
+        for i in range(first, len(pack)):
+            start, end, audio, text = pack[i]
+            print("Playing %.3f_%.3f" % (start, end))
+            print(text)
+            stream.write(bytes(audio))
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
 parser = argparse.ArgumentParser(description='Play transcribed wav files along with transcript')
-parser.add_argument('dir', help="Directory with .wav files")
+parser.add_argument('dir', help="Directory with .wav files, or a .segments.pack file")
+parser.add_argument('--at', type=float, default=0, help="Start at the segment at this time (pack files)")
 args = parser.parse_args()
+if segmentPack.is_pack(args.dir):
+    play_pack(args.dir, args.at)
+    sys.exit()
 files = glob.glob(os.path.join(os.getcwd(), args.dir, '*.wav'))
 sort_nicely(files)
 
@@ -0,0 +1,158 @@
+"""Sweeps VAD frame size, padding and trigger thresholds over one input.
+
+Runs the segmenter once per combination of the given settings and
+reports its throughput against how well its segments agree with the
+reference (the default 10 ms / 300 ms / 0.85 / 0.20 settings, or the first
+combination with --reference first): the fraction of reference segment
+boundaries found within --tolerance seconds (recall) and of its own
+boundaries that are in the reference (precision), and the overlap of
+speech time (IoU). Without an input file, synthetic speech is used.
+
+    $ python tools/vad_sweep.py --audio talk.wav --frame_ms 10 20 30 \\
+          --padding_ms 150 300 --json sweep.json
+"""
+import argparse, itertools, json, os, sys, tempfile, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import wavTranscriber
+
+from benchmark_vad import synthesize
+
+DEFAULTS = dict(frame_duration_ms=10, padding_duration_ms=300,
+                start_percentage=0.85, stop_percentage=0.20)
+
+
+def run_setting(path, aggressive, engine, params, repeat):
+    # Best of repeat runs; returns the boundaries, seconds and audio length
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        segments, _, audio_length = wavTranscriber.vad_segment_generator(
+            path, aggressive, engine=engine, **params)
+        boundaries = [(start, end) for _, start, end in segments]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return boundaries, best, audio_length
+
+
+def boundary_agreement(reference, candidate, tolerance):
+    # (recall, precision) of segment start/end times within tolerance
+    ref = np.sort(np.ravel(reference))
+    cand = np.sort(np.ravel(candidate))
+
+    def matched(a, b):
+        if not len(a):
+            return 1.0
+        if not len(b):
+            return 0.0
+        i = np.clip(np.searchsorted(b, a), 1, len(b) - 1)
+        nearest = np.minimum(np.abs(a - b[i - 1]), np.abs(a - b[i]))
+        return float(np.mean(nearest <= tolerance))
+
+    return matched(ref, cand), matched(cand, ref)
+
+
+def speech_iou(reference, candidate, audio_length, resolution=0.01):
+    # Intersection over union of the speech time, on a 10 ms grid
+    def mask(intervals):
+        m = np.zeros(int(audio_length / resolution) + 1, dtype=bool)
+        for start, end in intervals:
+            m[int(round(start / resolution)):int(round(end / resolution))] = True
+        return m
+
+    ref, cand = mask(reference), mask(candidate)
+    union = np.count_nonzero(ref | cand)
+    return np.count_nonzero(ref & cand) / union if union else 1.0
+
+
+def sweep(args, path):
+    settings = [
+        dict(frame_duration_ms=f, padding_duration_ms=p, start_percentage=s,
+             stop_percentage=t)
+        for f, p, s, t in itertools.product(args.frame_ms, args.padding_ms,
+                                            args.start, args.stop)
+    ]
+    reference = settings[0] if args.reference == 'first' else DEFAULTS
+    ref_boundaries, _, _ = run_setting(path, args.aggressive, args.engine,
+                                       reference, 1)
+    results = []
+    for params in settings:
+        boundaries, elapsed, audio_length = run_setting(
+            path, args.aggressive, args.engine, params, args.repeat)
+        recall, precision = boundary_agreement(ref_boundaries, boundaries,
+                                               args.tolerance)
+        num_frames = audio_length * 1000 / params['frame_duration_ms']
+        results.append(dict(params,
+                            seconds=elapsed,
+                            realtime=audio_length / elapsed,
+                            vad_calls_per_second=num_frames / elapsed,
+                            segments=len(boundaries),
+                            boundary_recall=recall,
+                            boundary_precision=precision,
+                            speech_iou=speech_iou(ref_boundaries, boundaries,
+                                                  audio_length)))
+        print_row(results[-1])
+    return results
+
+
+def print_row(row):
+    print("%2d ms  pad %4d  start %.2f  stop %.2f  %7.3fs %7.0fx RT "
+          "%9.0f calls/s  %5d segments  recall %.3f  precision %.3f  "
+          "IoU %.3f" %
+          (row['frame_duration_ms'], row['padding_duration_ms'],
+           row['start_percentage'], row['stop_percentage'], row['seconds'],
+           row['realtime'], row['vad_calls_per_second'], row['segments'],
+           row['boundary_recall'], row['boundary_precision'],
+           row['speech_iou']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare VAD speed and segment boundaries across settings.')
+    parser.add_argument('--audio',
+                        help='Input wav; synthetic speech when omitted')
+    parser.add_argument('--duration',
+                        type=int,
+                        default=600,
+                        help='Length of the synthetic input in seconds')
+    parser.add_argument('--frame_ms',
+                        nargs='+',
+                        type=int,
+                        choices=[10, 20, 30],
+                        default=[10, 20, 30])
+    parser.add_argument('--padding_ms',
+                        nargs='+',
+                        type=int,
+                        default=[300])
+    parser.add_argument('--start', nargs='+', type=float, default=[0.85])
+    parser.add_argument('--stop', nargs='+', type=float, default=[0.20])
+    parser.add_argument('--reference',
+                        choices=['default', 'first'],
+                        default='default',
+                        help='Compare against the default settings or the first combination')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.05,
+                        help='Seconds within which a boundary counts as matching')
+    parser.add_argument('--engine',
+                        choices=['collector', 'numpy'],
+                        default='collector')
+    parser.add_argument('--aggressive', type=int, default=1, choices=range(4))
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='Runs per setting; the fastest is reported')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = args.audio
+        if path is None:
+            path = os.path.join(workdir, 'speech.wav')
+            synthesize(path, args.duration, 16000, 'speech')
+        results = sweep(args, path)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from threading import Lock
+
+
+class TranscriptCache(object):
+    """On-disk cache of segment transcripts.
+
+    Entries are keyed by a hash of the segment PCM together with the sample
+    rate, language and recognizer backend, so identical audio is only sent
+    to the recognizer once. Unintelligible results are cached as None.
+    Once the stored transcripts exceed max_bytes, the least recently used
+    entries are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'transcripts.db'),
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS transcripts ('
+                        'key TEXT PRIMARY KEY, text TEXT, '
+                        'size INTEGER, last_access REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS transcripts_lru '
+                        'ON transcripts (last_access)')
+        self.size = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM transcripts').fetchone()[0]
+
+    @staticmethod
+    def key(pcm, sample_rate, language, backend):
+        h = hashlib.sha256(pcm)
+        h.update(("|%d|%s|%s" % (sample_rate, language, backend)).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns (found, transcript) for key."""
+        with self.lock:
+            row = self.db.execute('SELECT text FROM transcripts WHERE key = ?',
+                                  (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.db.execute(
+                'UPDATE transcripts SET last_access = ? WHERE key = ?',
+                (time.time(), key))
+            self.db.commit()
+            return True, row[0]
+
+    def put(self, key, text):
+        size = len(key) + (len(text.encode()) if text is not None else 0)
+        with self.lock:
+            row = self.db.execute('SELECT size FROM transcripts WHERE key = ?',
+                                  (key, )).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.db.execute(
+                'INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)',
+                (key, text, size, time.time()))
+            self.size += size
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        while self.size > self.max_bytes:
+            row = self.db.execute('SELECT key, size FROM transcripts '
+                                  'ORDER BY last_access LIMIT 1').fetchone()
+            if row is None:
+                break
+            self.db.execute('DELETE FROM transcripts WHERE key = ?',
+                            (row[0], ))
+            self.size -= row[1]
+
+    def close(self):
+        with self.lock:
+            self.db.close()